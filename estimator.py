@@ -29,7 +29,9 @@ class DPGBDT(BaseEstimator):  # type: ignore
                use_3_trees: bool = False,
                binary_classification: bool = False,
                cat_idx: Optional[List[int]] = None,
-               num_idx: Optional[List[int]] = None) -> None:
+               num_idx: Optional[List[int]] = None,
+               n_jobs: Optional[int] = None,
+               seed: Optional[int] = None) -> None:
     """Initialize the wrapper.
 
     Args:
@@ -59,6 +61,12 @@ class DPGBDT(BaseEstimator):  # type: ignore
           predictions to labels.
       cat_idx (List): Optional. List of indices for categorical features.
       num_idx (List): Optional. List of indices for numerical features.
+      n_jobs (int): Optional. The number of threads used for predictions, and
+          of processes used to fit the per-class trees in multi-class
+          classification. -1 means all processors. Default is None, i.e. a
+          single one, which the compiled prediction kernels also stick to.
+      seed (int): Optional. Seed for the model's random generator. Default is
+          None, i.e. seeded from NumPy's global random state.
     """
     self.model = None
     self.privacy_budget = privacy_budget
@@ -74,6 +82,8 @@ class DPGBDT(BaseEstimator):  # type: ignore
     self.binary_classification = binary_classification
     self.cat_idx = cat_idx
     self.num_idx = num_idx
+    self.n_jobs = n_jobs
+    self.seed = seed
     self.model = GradientBoostingEnsemble(
         self.nb_trees,
         self.nb_trees_per_ensemble,
@@ -87,7 +97,9 @@ class DPGBDT(BaseEstimator):  # type: ignore
         use_bfs=self.use_bfs,
         use_3_trees=self.use_3_trees,
         cat_idx=self.cat_idx,
-        num_idx=self.num_idx)
+        num_idx=self.num_idx,
+        n_jobs=self.n_jobs,
+        seed=self.seed)
 
   def fit(self, X: np.array, y: np.array) -> 'GradientBoostingEnsemble':
     """Fit the model to the dataset.
@@ -142,7 +154,9 @@ class DPGBDT(BaseEstimator):  # type: ignore
         'use_3_trees': self.use_3_trees,
         'binary_classification': self.binary_classification,
         'cat_idx': self.cat_idx,
-        'num_idx': self.num_idx
+        'num_idx': self.num_idx,
+        'n_jobs': self.n_jobs,
+        'seed': self.seed
     }
 
   def set_params(self,
@@ -8,18 +8,75 @@ From: https://arxiv.org/pdf/1911.04209.pdf
 import math
 import logging
 import operator
-from queue import Queue
-from typing import List, Any, Optional, Dict, Tuple
+import types
+from collections import deque
+from typing import (List, Any, Optional, Tuple, Deque, NamedTuple, Callable,
+                    TypeVar)
 
 import numpy as np
 # pylint: disable=import-error
+from joblib import Parallel, delayed, effective_n_jobs
 from sklearn.model_selection import train_test_split
 # pylint: enable=import-error
 from sklearn.ensemble._gb_losses import LeastSquaresError, MultinomialDeviance, LossFunction
 
+try:
+  import numba  # pylint: disable=import-error
+except ImportError:
+  # numba is optional, the kernels then run as plain Python and the NumPy
+  # code paths are used instead
+  numba = None  # type: ignore
+
+# Type of the functions compiled with `_Jit`
+_F = TypeVar('_F', bound=Callable[..., Any])
+
 logger = logging.getLogger(__name__)
 
 
+def _Jit(**kwargs: Any) -> Callable[[_F], _F]:
+  """Compile a function with numba's njit, if numba is installed.
+
+  Args:
+    kwargs: Options passed to numba.njit.
+
+  Returns:
+    Callable: A decorator returning the compiled (or unchanged) function,
+        with the function's signature.
+  """
+  def Decorator(function: _F) -> _F:
+    if numba is None:
+      return function
+    return numba.njit(**kwargs)(function)  # type: ignore
+  return Decorator
+
+
+def _Renamed(function: Any, name: str) -> Any:
+  """Return a copy of a function under another name.
+
+  Used to compile a kernel with other options: numba caches the compiled
+  code by function name, so the copies don't load each other's code.
+
+  Args:
+    function (Any): The function to copy.
+    name (str): The name of the copy.
+
+  Returns:
+    Any: The copy of the function.
+  """
+  copy = types.FunctionType(function.__code__, function.__globals__, name,
+                            function.__defaults__, function.__closure__)
+  copy.__qualname__ = name
+  copy.__doc__ = function.__doc__
+  return copy
+
+
+_prange = numba.prange if numba is not None else range
+
+# A split chosen for a node: the feature's index, the (binned) value to split
+# on and the gain used by the exponential mechanism
+Split = NamedTuple('Split', [('index', int), ('value', Any), ('gain', float)])
+
+
 class GradientBoostingEnsemble:
   """Implement gradient boosting ensemble of trees.
 
@@ -50,7 +107,9 @@ class GradientBoostingEnsemble:
                use_bfs: bool = False,
                use_3_trees: bool = False,
                cat_idx: Optional[List[int]] = None,
-               num_idx: Optional[List[int]] = None) -> None:
+               num_idx: Optional[List[int]] = None,
+               n_jobs: Optional[int] = None,
+               seed: Optional[int] = None) -> None:
     """Initialize the GradientBoostingEnsemble class.
 
     Args:
@@ -79,6 +138,12 @@ class GradientBoostingEnsemble:
           Default is False.
       cat_idx (List): Optional. List of indices for categorical features.
       num_idx (List): Optional. List of indices for numerical features.
+      n_jobs (int): Optional. The number of threads used for predictions, and
+          of processes used to fit the per-class trees in multi-class
+          classification. -1 means all processors. Default is None, i.e. a
+          single one, which the compiled prediction kernels also stick to.
+      seed (int): Optional. Seed for the model's random generator. Default is
+          None, i.e. seeded from NumPy's global random state.
       """
     self.nb_trees = nb_trees
     self.nb_trees_per_ensemble = nb_trees_per_ensemble
@@ -92,6 +157,12 @@ class GradientBoostingEnsemble:
     self.use_3_trees = use_3_trees
     self.cat_idx = cat_idx
     self.num_idx = num_idx
+    self.n_jobs = n_jobs
+    if seed is None:
+      seed = np.random.randint(np.iinfo(np.int32).max)
+    self._rng = np.random.default_rng(seed)
+    # Categorical feature mask, set when training
+    self._is_cat = np.zeros(0, dtype=np.bool_)
     self.trees = []  # type: List[List[DifferentiallyPrivateTree]]
     # classification vs regression
     self.loss_ = MultinomialDeviance(n_classes) if n_classes else LeastSquaresError(1)  # type: LossFunction
@@ -104,6 +175,9 @@ class GradientBoostingEnsemble:
     # Initial score
     self.init_score = None
 
+    # Feature binning, fitted on the training set
+    self.bin_mapper = None  # type: Optional[BinMapper]
+
     if self.use_3_trees and self.use_bfs:
       # Since we're building 3-node trees it's the same anyways.
       self.use_bfs = False
@@ -123,12 +197,25 @@ class GradientBoostingEnsemble:
 
     # Init gradients
     self.init_.fit(X, y)
-    self.init_score = self.loss_.get_init_raw_predictions(X, self.init_)  # (n_samples, K)
-    update_gradients = True
-
-    X_train, X_test, y_train, y_test = train_test_split(X, y)
+    # The initial estimator predicts the same raw scores for every sample, so
+    # only one row of shape (K,) is kept and broadcast
+    self.init_score = self.loss_.get_init_raw_predictions(
+        X[:1], self.init_)[0].astype(np.float32)
+
+    # Labels, gradients and predictions are handled in float32
+    y = np.ascontiguousarray(y, dtype=np.float32)
+    X_train, X_test, y_train, y_test = train_test_split(
+        X, y, random_state=self._rng.integers(np.iinfo(np.int32).max))
     X, y = X_train, y_train
 
+    # Bin the features once, trees are then grown on the uint8 bin indices
+    self.bin_mapper = BinMapper(cat_idx=self.cat_idx).Fit(X)
+    X = self.bin_mapper.Transform(X)
+    X_test = self.bin_mapper.Transform(X_test)
+    # Feature types, used to split nodes when combining 3-trees
+    self._is_cat = np.zeros(X.shape[1], dtype=np.bool_)
+    self._is_cat[self.cat_idx or []] = True
+
     # Number of ensembles in the model
     nb_ensembles = int(np.ceil(self.nb_trees / self.nb_trees_per_ensemble))
 
@@ -144,6 +231,40 @@ class GradientBoostingEnsemble:
 
     prev_score = np.inf
 
+    # Number of rows each tree will use for training
+    if self.balance_partition:
+      # All trees of an ensemble receive the same amount of samples. If the
+      # last ensemble is smaller, its trees share the data between fewer trees
+      rows_per_tree = np.full(self.nb_trees,
+                              len(X) // self.nb_trees_per_ensemble)
+      last_ensemble_size = self.nb_trees % self.nb_trees_per_ensemble
+      if last_ensemble_size:
+        rows_per_tree[-last_ensemble_size:] = len(X) // last_ensemble_size
+    else:
+      # Line 8 of Algorithm 2 from the paper
+      tree_in_ensemble = np.arange(self.nb_trees) % self.nb_trees_per_ensemble
+      rows_per_tree = (len(X) * self.learning_rate * np.power(
+          (1 - self.learning_rate), tree_in_ensemble) / (
+              1 - math.pow((1 - self.learning_rate),
+                           self.nb_trees_per_ensemble))).astype(np.int64)
+
+    # If using the formula from the algorithm, some trees may not get
+    # samples. Those trees are skipped and a warning is issued. This should
+    # hint the user to change its parameters (likely the ensembles are too
+    # unbalanced)
+    if (rows_per_tree == 0).any():
+      logger.warning('The choice of trees per ensemble vs. the total number '
+                     'of trees is not balanced properly; some trees will '
+                     'not get any training samples. Try using '
+                     'balance_partition=True or change your parameters.')
+
+    # Running sums of the tree predictions, updated only when a tree is kept
+    train_predictions = self._SumTrees(X, self.trees)
+    test_predictions = self._SumTrees(X_test, self.trees)
+
+    # Rows of the current ensemble's dataset not used by its trees yet
+    alive = np.ones(len(X), dtype=bool)
+
     # Train all trees
     for tree_index in range(self.nb_trees):
       # Compute sensitivity
@@ -154,67 +275,34 @@ class GradientBoostingEnsemble:
 
       current_tree_for_ensemble = tree_index % self.nb_trees_per_ensemble
       if current_tree_for_ensemble == 0:
-        # Initialize the dataset and the gradients
-        X_ensemble = np.copy(X)
-        y_ensemble = np.copy(y)
+        # Initialize the dataset and the gradients. Rows used by previous
+        # trees of the ensemble are masked out rather than deleted.
+        alive = np.ones(len(X), dtype=bool)
         prev_score = np.inf
-        update_gradients = True
         # gradient initialization will happen later in the per-class-loop
 
-      # Compute the number of rows that the current tree will use for training
-      if self.balance_partition:
-        # All trees will receive same amount of samples
-        if self.nb_trees % self.nb_trees_per_ensemble == 0:
-          # Perfect split
-          number_of_rows = int(len(X) / self.nb_trees_per_ensemble)
-        else:
-          # Partitioning data across ensembles
-          if np.ceil(tree_index / self.nb_trees_per_ensemble) == np.ceil(
-              self.nb_trees / self.nb_trees_per_ensemble):
-            number_of_rows = int(len(X) / (
-                self.nb_trees % self.nb_trees_per_ensemble))
-          else:
-            number_of_rows = int(len(X) / self.nb_trees_per_ensemble) + int(
-                len(X) / (self.nb_trees % self.nb_trees_per_ensemble))
-      else:
-        # Line 8 of Algorithm 2 from the paper
-        number_of_rows = int((len(X) * self.learning_rate * math.pow(
-          (1 - self.learning_rate), current_tree_for_ensemble)) / (
-              1 - math.pow((
-                  1 - self.learning_rate), self.nb_trees_per_ensemble)))
-
-      # If using the formula from the algorithm, some trees may not get
-      # samples. In that case we skip the tree and issue a warning. This
-      # should hint the user to change its parameters (likely the ensembles
-      # are too unbalanced)
+      # Number of rows that the current tree will use for training
+      number_of_rows = rows_per_tree[tree_index]
       if number_of_rows == 0:
-        logger.warning('The choice of trees per ensemble vs. the total number '
-                       'of trees is not balanced properly; some trees will '
-                       'not get any training samples. Try using '
-                       'balance_partition=True or change your parameters.')
         continue
 
       # Select <number_of_rows> rows at random from the ensemble dataset
-      rows = np.random.randint(len(X_ensemble), size=number_of_rows)
-      X_tree = X_ensemble[rows, :]
-      y_tree = y_ensemble[rows]
+      alive_rows = np.flatnonzero(alive)
+      rows = alive_rows[self._rng.integers(len(alive_rows),
+                                           size=number_of_rows,
+                                           dtype=np.int32)]
+      X_tree = X[rows, :]
+      y_tree = y[rows]
 
       # train for each class a seperate tree on the same rows.
       # In regression or binary classification, K has been set to one.
-      k_trees = []  # type: List[DifferentiallyPrivateTree]
+      fit_jobs = []  # type: List[Any]
       for kth_tree in range(self.loss_.K):
-        if tree_index == 0:
-            # First tree, start with initial scores (mean of labels)
-            gradients = self.ComputeGradientForLossFunction(
-                y, self.init_score[:len(y)], kth_tree)
-        else:
-            # Update gradients of all training instances on loss l
-            if update_gradients:
-                gradients = self.ComputeGradientForLossFunction(
-                    y_ensemble, self.Predict(X_ensemble), kth_tree)  # type: ignore
-
-        assert gradients is not None
-        gradients_tree = gradients[rows]
+        # Gradients of the selected instances on loss l, from the running
+        # predictions. The first tree starts with the initial scores (mean of
+        # labels).
+        gradients_tree = self.ComputeGradientForLossFunction(
+            y[rows], self.init_score + train_predictions[rows], kth_tree)
 
         # Gradient based data filtering
         norm_1_gradient = np.abs(gradients_tree)
@@ -242,33 +330,39 @@ class GradientBoostingEnsemble:
             use_bfs=self.use_bfs,
             use_3_trees=self.use_3_trees,
             cat_idx=self.cat_idx,
-            num_idx=self.num_idx)
+            num_idx=self.num_idx,
+            bin_mapper=self.bin_mapper,
+            seed=self._rng.integers(np.iinfo(np.int32).max))
         # in multi-class classification, the target has to be binary
         # as each tree is a per-class regressor
-        y_target = ((y_tree == kth_tree).astype(np.float64)
+        y_target = ((y_tree == kth_tree).astype(np.float32)
                     if self.loss_.is_multi_class
                     else y_tree)
-        tree.Fit(X_tree, y_target, gradients_tree)
-
-        # Add the tree to its corresponding ensemble
-        k_trees.append(tree)
-      self.trees.append(k_trees)
-
-      score = self.loss_(y_test, self.Predict(X_test))  # i.e. mse or deviance
-      if score >= prev_score:
-        # This tree doesn't improve overall prediction quality, removing from
-        # model
-        update_gradients = self.loss_.is_multi_class  # not reusing gradients in multi-class as they are class-dependent
-        self.trees.pop()
-      else:
+        fit_jobs.append(delayed(FitTree)(tree, X_tree, y_target,
+                                         gradients_tree))
+
+      # The trees of the K classes only depend on the current gradients, so
+      # they are fitted in parallel. Each tree draws from its own seed.
+      k_trees = Parallel(n_jobs=self.n_jobs if self.loss_.K > 1 else None,
+                         backend='loky')(
+                             fit_jobs)  # type: List[DifferentiallyPrivateTree]
+
+      new_test_predictions = test_predictions + self._SumTrees(X_test,
+                                                               [k_trees])
+      score = self.loss_(y_test, self.init_score +
+                         new_test_predictions)  # i.e. mse or deviance
+      # A tree that doesn't improve overall prediction quality is not added to
+      # the model
+      if score < prev_score:
         print(tree_index, score)
-        update_gradients = True
+        self.trees.append(k_trees)
+        test_predictions = new_test_predictions
+        train_predictions += self._SumTrees(X, [k_trees])
         prev_score = score
         # Remove the selected rows from the ensemble's dataset
         # The instances that were filtered out by GBF can still be used for the
         # training of the next trees
-        X_ensemble = np.delete(X_ensemble, selected_rows, axis=0)
-        y_ensemble = np.delete(y_ensemble, selected_rows)
+        alive[selected_rows] = False
     if self.use_3_trees:
       self.Combine_3_trees(self.trees)
     return self
@@ -281,67 +375,87 @@ class GradientBoostingEnsemble:
       k_trees (List[List[DifferentiallyPrivateTree]]): A k-list of 3-trees.
     """
 
+    assert self.bin_mapper is not None
     self.trees = []  # Re-init final predictions trees
+    # Gram matrices of the trees' datasets per class, stacked once for all
+    # the trees they are candidates for
+    class_grams = [
+        np.stack([i[k].gram for i in k_trees])
+        for k in range(len(k_trees[0]))
+    ] if k_trees else []  # type: List[np.array]
+    # A dataset with only zero values has a zero Gram matrix
+    class_non_empty = [
+        grams.any(axis=(1, 2)) for grams in class_grams
+    ]  # type: List[np.array]
     for index, k_three_tree in enumerate(k_trees):  # iterate through the ensemble
       k_trees_ = []  # type: List[DifferentiallyPrivateTree]
       for k, three_tree in enumerate(k_three_tree):  # iterate through the classes
         # select a whole ensemble per class; continue as if there were only one class
-        copy = list(np.copy([i[k] for i in k_trees]))
-        copy.pop(index)
-        if len(copy) == 0:
+        # The other trees of the class that are left to graft, as a mask
+        remaining = np.ones(len(k_trees), dtype=bool)
+        remaining[index] = False
+        if not remaining.any():
           continue
-        queue_children = Queue()  # type: Queue['DecisionNode']
-        queue_children.put(three_tree.root_node.left_child)  # type: ignore
-        queue_children.put(three_tree.root_node.right_child)  # type: ignore
+        queue_children = deque()  # type: Deque[Optional[DecisionNode]]
+        new_leaves = []  # type: List[DecisionNode]
+        queue_children.append(three_tree.root_node.left_child)  # type: ignore
+        queue_children.append(three_tree.root_node.right_child)  # type: ignore
         depth = 1
-        privacy_budget_for_node = np.around(
-            np.divide(three_tree.privacy_budget / 2, three_tree.max_depth + 1),
-            decimals=7)
-        while not queue_children.empty():
-          if depth == self.max_depth or len(copy) == 0:
+        while queue_children:
+          if depth == self.max_depth or not remaining.any():
             break
-          left_child = queue_children.get()
-          right_child = queue_children.get()
+          left_child = queue_children.popleft()
+          right_child = queue_children.popleft()
           for child in [left_child, right_child]:
-            if len(copy) == 0 or not child or not child.X.any():  # type: ignore
+            if not remaining.any() or not child:
+              continue
+            # Nodes are compared on feature values, not on bin indices
+            child_values = self.bin_mapper.InverseTransform(
+                child.X)  # type: ignore
+            if not child_values.any():
               continue
             # Apply exponential mechanism to find sub 3-node tree
-            probabilities = []
-            max_gain = -np.inf
-            for candidate_index, candidate in enumerate(copy):
-              if not candidate.root_node.X.any():
-                continue
-              # Compute distance between the two nodes. Lower is better.
-              gain = np.linalg.norm(np.matmul(np.transpose(
-                  child.X), child.X) - np.matmul(np.transpose(
-                      candidate.root_node.X), candidate.root_node.X))
-              exp_gain = (privacy_budget_for_node * gain) / (
-                  2. * three_tree.delta_g)
-              if exp_gain > max_gain:
-                max_gain = exp_gain
-              prob = {
-                'candidate_index': candidate_index,
-                'index': candidate.root_node.index,
-                'value': candidate.root_node.value,
-                'gain': exp_gain
-              }
-              probabilities.append(prob)
-            candidate = ExponentialMechanism(
-                probabilities, max_gain, reverse=True)
-            if not candidate or not candidate['index'] or not candidate['value']:
+            candidate_indices = np.flatnonzero(remaining & class_non_empty[k])
+            if len(candidate_indices) == 0:
+              continue
+            # Compute distance between the two nodes. Lower is better.
+            gains = np.linalg.norm(
+                GramMatrix(child_values) - class_grams[k][candidate_indices],
+                axis=(1, 2))
+            exp_gains = gains * three_tree.exp_gain_scale
+            if (exp_gains <= 0.).all():
+              continue
+            # Gumbel-max trick: same distribution as sampling with
+            # probabilities proportional to exp(-exp_gain)
+            candidate_index = candidate_indices[np.argmax(
+                self._rng.gumbel(size=len(exp_gains)) - exp_gains)]
+            candidate = k_trees[candidate_index][k].root_node
+            assert candidate is not None
+            if not candidate.index or not candidate.value:
               continue
-            copy.pop(candidate['candidate_index'])
-            split_index = candidate['index']
-            split_value = candidate['value']
-            left_, right_ = self.SplitNode(child,
-                                           split_index,
-                                           split_value,
-                                           three_tree.privacy_budget,
-                                           index,
-                                           three_tree.delta_v)
-            queue_children.put(left_)
-            queue_children.put(right_)
+            remaining[candidate_index] = False
+            split_index = candidate.index
+            split_value = candidate.value
+            left_, right_ = self.SplitNode(child, split_index, split_value)
+            new_leaves += [left_, right_]
+            queue_children.append(left_)
+            queue_children.append(right_)
           depth += 1
+        # Apply Geometry leaf clipping, add noise to the new leaf predictions
+        # and shrink them by learning rate, drawing all the noise at once
+        new_leaves = [
+            leaf for leaf in new_leaves if leaf.prediction is not None
+        ]
+        if new_leaves:
+          laplace_scale = three_tree.delta_v / three_tree.privacy_budget / 2
+          rng = three_tree._rng  # pylint: disable=protected-access
+          PrivatizeLeaves(new_leaves,
+                          self.l2_threshold,
+                          self.learning_rate,
+                          index,
+                          laplace_scale,
+                          rng=rng)
+        three_tree.Flatten()
         k_trees_.append(three_tree)
       self.trees.append(k_trees_)
     if not self.trees or self.trees == [[]]:
@@ -350,19 +464,16 @@ class GradientBoostingEnsemble:
   def SplitNode(self,
                 node: 'DecisionNode',
                 index: int,
-                value: float,
-                tree_privacy_budget: float,
-                tree_index: int,
-                delta_v: float) -> Tuple['DecisionNode', 'DecisionNode']:
+                value: float) -> Tuple['DecisionNode', 'DecisionNode']:
     """Split children of a 3-nodes tree based on the (index, value) pair.
 
+    The children's predictions are raw: they are clipped, noised and shrunk
+    once all the tree's splits are done.
+
     Args:
       node (DecisionNode): The node to split.
       index (int): The feature's index on which to split the node.
       value (float): The feature's value on which to split the node.
-      tree_privacy_budget (float): The privacy budget for the current tree.
-      tree_index (int): The index of the tree.
-      delta_v (float): The loss function's sensitivity for the tree.
 
     Returns:
       Tuple: Children created after the split.
@@ -372,14 +483,19 @@ class GradientBoostingEnsemble:
     assert node.y is not None
     assert node.gradients is not None
 
-    # Split indices of instances from the node's dataset
-    lhs_op, rhs_op = self.GetOperators(index)
-    lhs = np.where(lhs_op(node.X[:, index], value))[0]
-    rhs = np.where(rhs_op(node.X[:, index], value))[0]
+    # Split the node's dataset with a single comparison, each side being
+    # gathered once
+    lhs_op, _ = self.GetOperators(index)
+    lhs_mask = lhs_op(node.X[:, index], value)
+    rhs_mask = ~lhs_mask
+    lhs_grad, rhs_grad = node.gradients[lhs_mask], node.gradients[rhs_mask]
+    lhs_y, rhs_y = node.y[lhs_mask], node.y[rhs_mask]
 
     # Compute the associated predictions
-    lhs_prediction = ComputePredictions(node.gradients[lhs], node.y[lhs], self.loss_, self.l2_lambda)
-    rhs_prediction = ComputePredictions(node.gradients[rhs], node.y[rhs], self.loss_, self.l2_lambda)
+    lhs_prediction = ComputePredictions(
+        lhs_grad, lhs_y, self.loss_, self.l2_lambda)
+    rhs_prediction = ComputePredictions(
+        rhs_grad, rhs_y, self.loss_, self.l2_lambda)
 
     # Mark current node as split node and not leaf node
     node.prediction = None
@@ -388,29 +504,16 @@ class GradientBoostingEnsemble:
 
     # Add children to node
     node.left_child = DecisionNode(
-        X=node.X[lhs],
-        y=node.y[lhs],
+        X=node.X[lhs_mask],
+        y=lhs_y,
         prediction=lhs_prediction,
-        gradients=node.gradients[lhs])
+        gradients=lhs_grad)
     node.right_child = DecisionNode(
-        X=node.X[rhs],
-        y=node.y[rhs],
+        X=node.X[rhs_mask],
+        y=rhs_y,
         prediction=rhs_prediction,
-        gradients=node.gradients[rhs])
-
-    # Apply Geometry leaf clipping
-    ClipLeaves([node.left_child, node.right_child],
-               self.l2_threshold,
-               self.learning_rate,
-               tree_index)
-
-    # Add noise to the leaf predictions
-    laplace_scale = delta_v / tree_privacy_budget / 2
-    AddLaplacianNoise([node.left_child, node.right_child],
-                      laplace_scale)
-
-    # Shrink by learning rate
-    Shrink([node.left_child, node.right_child], self.learning_rate)
+        gradients=rhs_grad)
+    node.X = node.y = node.gradients = None
 
     return node.left_child, node.right_child
 
@@ -425,11 +528,56 @@ class GradientBoostingEnsemble:
     Returns:
       np.array of shape (n_samples, K): The predictions.
     """
-    # sum across the ensemble per class
-    predictions = np.sum([[tree.Predict(X) for tree in k_trees] for k_trees in self.trees], axis=0).T
+    assert self.bin_mapper is not None
     assert self.init_score is not None
-    init_score = self.init_score[:len(predictions)]
-    return np.add(init_score, predictions)
+    X = self.bin_mapper.Transform(X)
+    n_jobs = effective_n_jobs(self.n_jobs)
+    if n_jobs == 1:
+      predictions = self._SumTrees(X, self.trees)
+    elif numba is not None and len(X) >= _MIN_PARALLEL_ROWS:
+      # Many rows: each tree spreads them over n_jobs threads of its own,
+      # instead of joblib threads
+      num_threads = numba.get_num_threads()
+      max_threads = numba.config.NUMBA_NUM_THREADS  # pylint: disable=no-member
+      numba.set_num_threads(min(n_jobs, max_threads))
+      try:
+        predictions = self._SumTrees(X, self.trees, parallel=True)
+      finally:
+        numba.set_num_threads(num_threads)
+    elif len(X) >= 2000 and len(self.trees) >= 100:
+      # Large batches: chunks of rows in parallel, each going through all trees
+      chunks = Parallel(n_jobs=self.n_jobs, prefer='threads')(
+          delayed(self._SumTrees)(X[start:start + 128], self.trees)
+          for start in range(0, len(X), 128))
+      predictions = np.concatenate(chunks)
+    else:
+      # Small batches: trees in parallel
+      predictions = np.zeros((len(X), self.loss_.K), dtype=np.float32)
+      for tree_predictions in Parallel(n_jobs=self.n_jobs, prefer='threads')(
+          delayed(self._SumTrees)(X, [k_trees]) for k_trees in self.trees):
+        predictions += tree_predictions
+    return np.add(self.init_score, predictions)
+
+  def _SumTrees(self,
+                X: np.array,
+                trees: List[List['DifferentiallyPrivateTree']],
+                parallel: bool = False) -> np.array:
+    """Sum the predictions of trees per class.
+
+    Args:
+      X (np.array): The binned dataset for which to predict values.
+      trees (List[List[DifferentiallyPrivateTree]]): The k-class trees.
+      parallel (bool): Optional. Whether the trees spread the rows over
+          threads. Default is False.
+
+    Returns:
+      np.array of shape (n_samples, K): The summed predictions, as float32.
+    """
+    predictions = np.zeros((len(X), self.loss_.K), dtype=np.float32)
+    for k_trees in trees:
+      for k, tree in enumerate(k_trees):
+        predictions[:, k] += tree.Predict(X, parallel=parallel)
+    return predictions
 
   def PredictLabels(self, X: np.ndarray) -> np.ndarray:
     """Predict labels out of the raw prediction values of `Predict`.
@@ -457,13 +605,13 @@ class GradientBoostingEnsemble:
       k (int): the class.
 
     Returns:
-      (np.array): The gradient of the loss function.
+      (np.array): The gradient of the loss function, as float32.
     """
     if self.loss_.is_multi_class:
-      y = (y == k).astype(np.float64)
+      y = (y == k).astype(np.float32)
     # sklearn's impl is using the negative gradient (i.e. y - F).
     # Here the positive gradient is used though
-    return -self.loss_.negative_gradient(y, y_pred, k=k)
+    return -self.loss_.negative_gradient(y, y_pred, k=k).astype(np.float32)
 
   def GetOperators(self, index: int) -> Tuple[Any, Any]:
     """Return operators to use to split a node's dataset.
@@ -474,7 +622,7 @@ class GradientBoostingEnsemble:
     Returns:
       Tuple[Any, Any]: The operators to use.
     """
-    if self.cat_idx and index in self.cat_idx:
+    if self._is_cat[index]:
       # Categorical feature
       return operator.eq, operator.ne
     # Numerical feature
@@ -485,9 +633,12 @@ class DecisionNode:
   """Implement a decision node.
 
   Attributes:
-    X (np.array): The dataset.
-    y (np.ndarray): The dataset labels.
-    gradients (np.array): The gradients for the dataset instances.
+    X (np.array): The dataset. Only for 3-tree construction.
+    y (np.ndarray): The dataset labels. Only for 3-tree construction.
+    gradients (np.array): The gradients for the dataset instances. Only for
+        3-tree construction.
+    rows (np.array): Indices of the node's instances in the tree's dataset.
+        Only for BFS tree construction.
     index (int): An index for the feature on which the node splits.
     value (Any): The corresponding value for that index.
     depth (int): The depth of the node.
@@ -501,6 +652,7 @@ class DecisionNode:
                X: Optional[np.array] = None,
                y: Optional[np.array] = None,
                gradients: Optional[np.array] = None,
+               rows: Optional[np.array] = None,
                index: Optional[int] = None,
                value: Optional[Any] = None,
                depth: Optional[int] = None,
@@ -511,10 +663,13 @@ class DecisionNode:
 
     Args:
       X (np.array): Optional. The dataset associated to the node. Only for
-          BFS tree and 3-tree construction.
+          3-tree construction.
       y (np.ndarray): Optional. The dataset labels associated to the node and
-          used for the leaf predictions. Only for BFS tree and 3-tree construction.
-      gradients (np.array): The gradients for the dataset instances.
+          used for the leaf predictions. Only for 3-tree construction.
+      gradients (np.array): Optional. The gradients for the dataset instances.
+          Only for 3-tree construction.
+      rows (np.array): Optional. Indices (int32) of the node's instances in the
+          tree's dataset. Only for BFS tree construction.
       index (int): Optional. An index for the feature on which the node splits.
           Default is None.
       value (Any): Optional. The corresponding value for that index. Default
@@ -533,6 +688,7 @@ class DecisionNode:
     self.X = X
     self.y = y
     self.gradients = gradients
+    self.rows = rows
     self.index = index
     self.value = value
     self.depth = depth
@@ -555,9 +711,19 @@ class DifferentiallyPrivateTree:
     privacy_budget (float): The tree's privacy budget.
     delta_g (float): The utility function's sensitivity.
     delta_v (float): The sensitivity for leaf clipping.
+    exp_gain_scale (float): The factor turning a split's gain into its
+        exponential mechanism score.
     loss (LossFunction): An sklearn loss wrapper
         suitable for regression and classification.
     max_depth (int): Max. depth for the tree.
+    depth (int): The depth of the fitted tree, as stored in the arrays below.
+    feature_indices (np.array): For each split node, the feature's index.
+    thresholds (np.array): For each split node, the value rows that go right
+        are greater than or equal to.
+    leaf_values (np.array): The leaf predictions, on the last level.
+    bin_mapper (BinMapper): The mapper the tree's dataset was binned with.
+    gram (np.array): The Gram matrix of the tree's dataset, on feature values.
+        Only for 3-tree construction, where it is used to combine the trees.
   """
   # pylint: disable=invalid-name,too-many-arguments
 
@@ -576,7 +742,9 @@ class DifferentiallyPrivateTree:
                use_bfs: bool = False,
                use_3_trees: bool = False,
                cat_idx: Optional[List[int]] = None,
-               num_idx: Optional[List[int]] = None) -> None:
+               num_idx: Optional[List[int]] = None,
+               bin_mapper: Optional['BinMapper'] = None,
+               seed: Optional[int] = None) -> None:
     """Initialize the decision tree.
 
     Args:
@@ -604,11 +772,16 @@ class DifferentiallyPrivateTree:
           Default is False.
       cat_idx (List): Optional. List of indices for categorical features.
       num_idx (List): Optional. List of indices for numerical features.
+      bin_mapper (BinMapper): Optional. The mapper the dataset was binned
+          with. For 3-trees, the Gram matrix is computed on the feature values
+          it maps the bins back to. Default is None, i.e. on the bins.
+      seed (int): Optional. Seed for the random choices made while fitting the
+          tree, so that fitting doesn't depend on where it runs.
     """
     assert type(loss) in [LeastSquaresError, MultinomialDeviance]
 
     self.root_node = None  # type: Optional[DecisionNode]
-    self.nodes_bfs = Queue()  # type: Queue[DecisionNode]
+    self.nodes_bfs = deque()  # type: Deque[DecisionNode]
     self.nodes = []  # type: List[DecisionNode]
     self.tree_index = tree_index
     self.learning_rate = learning_rate
@@ -617,6 +790,10 @@ class DifferentiallyPrivateTree:
     self.privacy_budget = privacy_budget
     self.delta_g = delta_g
     self.delta_v = delta_v
+    # Half of the budget goes to the split nodes, which get an equal share
+    # per level. Depth + 1 because root node is at depth 0
+    privacy_budget_for_node = round(privacy_budget / 2 / (max_depth + 1), 7)
+    self.exp_gain_scale = privacy_budget_for_node / (2. * delta_g)
     self.loss = loss
     self.max_depth = max_depth
     self.max_leaves = max_leaves
@@ -625,6 +802,8 @@ class DifferentiallyPrivateTree:
     self.use_3_trees = use_3_trees
     self.cat_idx = cat_idx
     self.num_idx = num_idx
+    self.bin_mapper = bin_mapper
+    self._rng = np.random.default_rng(seed)
 
     if self.max_leaves and not use_bfs:
       # If max_leaves is specified, we grow the tree in a best-leaf first
@@ -635,6 +814,22 @@ class DifferentiallyPrivateTree:
     self.current_number_of_leaves = 0
     self.max_leaves_reached = False
 
+    # Categorical feature mask, set when fitting
+    self._is_cat = np.zeros(0, dtype=np.bool_)
+    # Buffers for the split candidates' gains and counts, reused by every
+    # node while fitting
+    self._gains = None  # type: Optional[np.array]
+    self._counts = None  # type: Optional[np.array]
+
+    # Array layout of the tree used for predictions, set by Flatten()
+    self.depth = 0
+    self.feature_indices = np.zeros(1, dtype=np.int32)
+    self.thresholds = np.zeros(1, dtype=np.float32)
+    self.leaf_values = np.zeros(1, dtype=np.float32)
+
+    # Summary of the dataset for combining 3-trees, set when fitting
+    self.gram = None  # type: Optional[np.array]
+
   def Fit(self, X: np.array, y: np.ndarray, gradients: np.array) -> None:
     """Fit the tree to the data.
 
@@ -644,32 +839,90 @@ class DifferentiallyPrivateTree:
       gradients (np.array): The gradients for the dataset instances.
     """
 
-    # Construct the tree recursively
+    # Feature types, used by the split finding kernel
+    self._is_cat = np.zeros(X.shape[1], dtype=np.bool_)
+    self._is_cat[self.cat_idx or []] = True
+    # Every node's histograms scan the columns, so they are made contiguous
+    # once for the whole tree
+    X = np.asfortranarray(X)
+    self._gains = np.empty((X.shape[1], 256))
+    self._counts = np.empty((X.shape[1], 256), dtype=np.int64)
+
+    # Grow the tree, from an explicit stack (DFS) or a node queue (BFS)
     if self.use_bfs:
       self.root_node = self.MakeTreeBFS(X, y, gradients)
     else:
       depth = 1 if self.use_3_trees else self.max_depth
       self.root_node = self.MakeTreeDFS(X, y, gradients, depth)
+    if self.use_3_trees:
+      self.gram = GramMatrix(self.bin_mapper.InverseTransform(X)
+                             if self.bin_mapper else X)
+    self._gains = self._counts = None
 
     leaves = [node for node in self.nodes if node.prediction]
 
-    # Clip the leaf nodes
-    ClipLeaves(leaves, self.l2_threshold, self.learning_rate, self.tree_index)
-
-    # Add noise to the predictions
+    # Clip the leaf nodes, add noise to the predictions and shrink them by
+    # learning rate
     privacy_budget_for_leaf_node = self.privacy_budget / 2
     laplace_scale = self.delta_v / privacy_budget_for_leaf_node
-    AddLaplacianNoise(leaves, laplace_scale)
+    PrivatizeLeaves(leaves,
+                    self.l2_threshold,
+                    self.learning_rate,
+                    self.tree_index,
+                    laplace_scale,
+                    rng=self._rng)
+
+    self.Flatten()
 
-    # Shrink by learning rate
-    Shrink(leaves, self.learning_rate)
+  def Flatten(self) -> None:
+    """Store the tree as arrays, used for predictions.
+
+    Nodes are laid out as a complete binary tree: the root is at position 1
+    and node i has its children at 2i (left) and 2i + 1 (right). Leaves above
+    the last level are pushed down with dummy splits that always go right, so
+    that every row goes through exactly `depth` splits.
+
+    Must be called again whenever the tree's nodes change.
+    """
+    assert self.root_node is not None
+    # Depth of the deepest leaf
+    self.depth = 0
+    stack = [(self.root_node, 0)]  # type: List[Tuple[DecisionNode, int]]
+    while stack:
+      node, depth = stack.pop()
+      if node.prediction is not None:
+        self.depth = max(self.depth, depth)
+        continue
+      stack.append((node.left_child, depth + 1))  # type: ignore
+      stack.append((node.right_child, depth + 1))  # type: ignore
+
+    size = 1 << self.depth
+    self.feature_indices = np.zeros(size, dtype=np.int32)
+    self.thresholds = np.full(size, -np.inf, dtype=np.float32)
+    self.leaf_values = np.zeros(size, dtype=np.float32)
+    stack = [(self.root_node, 1)]
+    while stack:
+      node, position = stack.pop()
+      if node.prediction is not None:
+        # Follow the dummy splits down to the last level
+        levels = self.depth - (position.bit_length() - 1)
+        position = (position << levels) + (1 << levels) - 1
+        self.leaf_values[position - size] = node.prediction
+        continue
+      self.feature_indices[position] = node.index
+      self.thresholds[position] = node.value
+      stack.append((node.left_child, 2 * position))  # type: ignore
+      stack.append((node.right_child, 2 * position + 1))  # type: ignore
 
   def MakeTreeDFS(self,
                   X: np.array,
                   y: np.ndarray,
                   gradients: np.array,
                   depth: int) -> DecisionNode:
-    """Build a tree recursively, in DFS fashion.
+    """Build a tree in DFS fashion.
+
+    Nodes are expanded from an explicit stack holding the indices of their
+    rows in the tree's dataset, instead of recursing on copies of the data.
 
     Args:
       X (np.array): The dataset.
@@ -681,51 +934,39 @@ class DifferentiallyPrivateTree:
       DecisionNode: A decision node.
     """
 
-    if depth == 0 or len(X) < self.min_samples_split:
+    root_node = DecisionNode()
+    # Right children are pushed first so that nodes are expanded in the same
+    # order as a recursive, left-first, construction
+    stack = [(root_node, np.arange(len(X), dtype=np.int32), depth)
+            ]  # type: List[Tuple[DecisionNode, np.array, int]]
+    while stack:
+      node, rows, depth = stack.pop()
+
+      best_split = None
       # Max depth reached or not enough samples to split node, node is a leaf
       # node
-      if self.use_3_trees:
-        node = DecisionNode(X=X,
-                            y=y,
-                            gradients=gradients,
-                            prediction=self.GetLeafPrediction(gradients, y))
-      else:
-        node = DecisionNode(prediction=self.GetLeafPrediction(gradients, y))
-      self.nodes.append(node)
-      return node
+      if depth > 0 and len(rows) >= self.min_samples_split:
+        best_split = self.FindBestSplit(X, gradients, rows)
+      if not best_split:
+        node.prediction = self.GetLeafPrediction(gradients[rows], y[rows])
+        # Leaves of 3-trees keep their dataset, to be split when combining
+        if self.use_3_trees:
+          node.X, node.y, node.gradients = X[rows], y[rows], gradients[rows]
+        self.nodes.append(node)
+        continue
 
-    best_split = self.FindBestSplit(X, gradients)
-    if best_split:
-      lhs_op, rhs_op = self.GetOperators(best_split['index'])
-      lhs = np.where(lhs_op(X[:, best_split['index']], best_split['value']))[0]
-      rhs = np.where(rhs_op(X[:, best_split['index']], best_split['value']))[0]
-      left_child = self.MakeTreeDFS(X[lhs], y[lhs], gradients[lhs], depth - 1)
-      right_child = self.MakeTreeDFS(X[rhs], y[rhs], gradients[rhs], depth - 1)
-      if self.use_3_trees:
-        node = DecisionNode(X=X,
-                            y=y,
-                            gradients=gradients,
-                            index=best_split['index'],
-                            value=best_split['value'],
-                            left_child=left_child,
-                            right_child=right_child)
-      else:
-        node = DecisionNode(index=best_split['index'],
-                            value=best_split['value'],
-                            left_child=left_child,
-                            right_child=right_child)
+      node.index = best_split.index
+      node.value = best_split.value
+      # The split feature's column is contiguous, it is read once for all
+      # of the node's rows
+      lhs_op, _ = self.GetOperators(node.index)  # type: ignore
+      lhs_mask = lhs_op(X[:, node.index].take(rows), node.value)
+      node.left_child = DecisionNode()
+      node.right_child = DecisionNode()
       self.nodes.append(node)
-      return node
-
-    if self.use_3_trees:
-      node = DecisionNode(X=X,
-                          y=y,
-                          gradients=gradients,
-                          prediction=self.GetLeafPrediction(gradients, y))
-    else:
-      node = DecisionNode(prediction=self.GetLeafPrediction(gradients, y))
-    self.nodes.append(node)
-    return node
+      stack.append((node.right_child, rows[~lhs_mask], depth - 1))
+      stack.append((node.left_child, rows[lhs_mask], depth - 1))
+    return root_node
 
   def MakeTreeBFS(self,
                   X: np.array,
@@ -742,120 +983,129 @@ class DifferentiallyPrivateTree:
       DecisionNode: A decision node.
     """
 
-    best_split = self.FindBestSplit(X, gradients)
+    rows = np.arange(len(X), dtype=np.int32)
+    best_split = self.FindBestSplit(X, gradients, rows)
     if not best_split:
       node = DecisionNode(prediction=self.GetLeafPrediction(gradients, y))
       self.nodes.append(node)
       return node
 
     # Root node
-    node = DecisionNode(X=X,
-                        y=y,
-                        gradients=gradients,
-                        index=best_split['index'],
-                        value=best_split['value'],
+    node = DecisionNode(rows=rows,
+                        index=best_split.index,
+                        value=best_split.value,
                         depth=0)
-    self.nodes.append(node)
-    self.nodes_bfs.put(node)
-    self._ExpandTreeBFS()
+    if self.use_3_trees:
+      node.X, node.y, node.gradients = X, y, gradients
+    # The root is added to the tree's nodes once expanded, like its children
+    self.nodes_bfs.append(node)
+    self._ExpandTreeBFS(X, y, gradients)
     for node in self.nodes:
       # Assigning predictions to remaining leaf nodes if we had to stop
       # constructing the tree early because we reached max number of leaf nodes
       if not node.prediction and not node.left_child and not node.right_child:
-        node.prediction = self.GetLeafPrediction(node.gradients, node.y)
+        node.prediction = self.GetLeafPrediction(gradients[node.rows],
+                                                 y[node.rows])
     return node
 
-  def _ExpandTreeBFS(self) -> None:
+  def _ExpandTreeBFS(self,
+                     X: np.array,
+                     y: np.ndarray,
+                     gradients: np.array) -> None:
     """Expand a tree in a best-leaf first fashion.
 
     Implement https://researchcommons.waikato.ac.nz/bitstream/handle/10289/2317
     /thesis.pdf?sequence=1&isAllowed=y
-    """
 
-    # Node queue is empty or too many leaves, stopping
-    if self.nodes_bfs.empty() or self.max_leaves_reached:
-      return None
+    Args:
+      X (np.array): The tree's dataset, indexed by the nodes' rows.
+      y (np.ndarray): The dataset labels.
+      gradients (np.array): The gradients for the dataset instances.
+    """
 
-    current_node = self.nodes_bfs.get()
+    # Stop when the node queue is empty or there are too many leaves
+    while self.nodes_bfs and not self.max_leaves_reached:
+      current_node = self.nodes_bfs.popleft()
 
-    # If there are not enough samples to split in that node, make it a leaf
-    # node and process next node
-    assert current_node.gradients is not None
-    if len(current_node.gradients) < self.min_samples_split:
-      self._MakeLeaf(current_node)
-      if not self._IsMaxLeafReached():
-        return self._ExpandTreeBFS()
-      return None
+      # If there are not enough samples to split in that node, make it a leaf
+      # node and process next node
+      assert current_node.rows is not None
+      if len(current_node.rows) < self.min_samples_split:
+        self._MakeLeaf(current_node, y, gradients)
+        self._IsMaxLeafReached()
+        continue
 
-    # If we reached max depth
-    if current_node.depth == self.max_depth:
-      self._MakeLeaf(current_node)
-      if not self._IsMaxLeafReached():
+      # If we reached max depth
+      if current_node.depth == self.max_depth:
+        self._MakeLeaf(current_node, y, gradients)
+        if self._IsMaxLeafReached():
+          return
         if self.max_leaves:
-          return self._ExpandTreeBFS()
-        while not self.nodes_bfs.empty():
-          node = self.nodes_bfs.get()
-          self._MakeLeaf(node)
-      return None
-
-    # Do the split
-    assert current_node.X is not None
-    assert current_node.y is not None
-    assert current_node.gradients is not None
-    lhs_op, rhs_op = self.GetOperators(current_node.index)  # type: ignore
-    lhs = np.where(
-        lhs_op(current_node.X[:, current_node.index], current_node.value))[0]
-    rhs = np.where(
-        rhs_op(current_node.X[:, current_node.index], current_node.value))[0]
-    lhs_X, rhs_X = current_node.X[lhs], current_node.X[rhs]
-    lhs_grad, rhs_grad = current_node.gradients[lhs], current_node.gradients[
-        rhs]
-    lhs_y, rhs_y = current_node.y[lhs], current_node.y[rhs]
-    lhs_best_split = self.FindBestSplit(lhs_X, lhs_grad)
-    rhs_best_split = self.FindBestSplit(rhs_X, rhs_grad)
-
-    # Can't split the node, so this becomes a leaf node.
-    if not lhs_best_split or not rhs_best_split:
-      self._MakeLeaf(current_node)
-      if not self._IsMaxLeafReached():
-        return self._ExpandTreeBFS()
-      return None
+          continue
+        while self.nodes_bfs:
+          self._MakeLeaf(self.nodes_bfs.popleft(), y, gradients)
+        return
+
+      # Do the split, with a mask over the node's instances only. The split
+      # feature's column is contiguous, it is read once for all of them
+      lhs_op, _ = self.GetOperators(current_node.index)  # type: ignore
+      lhs_mask = lhs_op(X[:, current_node.index].take(current_node.rows),
+                        current_node.value)
+      lhs_rows = current_node.rows[lhs_mask]
+      rhs_rows = current_node.rows[~lhs_mask]
+      lhs_best_split = self.FindBestSplit(X, gradients, lhs_rows)
+      rhs_best_split = self.FindBestSplit(X, gradients, rhs_rows)
+
+      # Can't split the node, so this becomes a leaf node.
+      if not lhs_best_split or not rhs_best_split:
+        self._MakeLeaf(current_node, y, gradients)
+        self._IsMaxLeafReached()
+        continue
 
-    # Splitting the node is possible, creating the children
-    assert current_node.depth is not None
-    left_child = DecisionNode(X=lhs_X,
-                              y=lhs_y,
-                              gradients=lhs_grad,
-                              index=lhs_best_split['index'],
-                              value=lhs_best_split['value'],
-                              depth=current_node.depth + 1)
-    right_child = DecisionNode(X=rhs_X,
-                               y=rhs_y,
-                               gradients=rhs_grad,
-                               index=rhs_best_split['index'],
-                               value=rhs_best_split['value'],
-                               depth=current_node.depth + 1)
-
-    current_node.left_child = left_child
-    current_node.right_child = right_child
-    self.nodes.append(current_node)
-
-    # Adding them to the list of nodes for further expansion in best-gain order
-    if lhs_best_split['gain'] >= rhs_best_split['gain']:
-      self.nodes_bfs.put(left_child)
-      self.nodes_bfs.put(right_child)
-    else:
-      self.nodes_bfs.put(right_child)
-      self.nodes_bfs.put(left_child)
-    return self._ExpandTreeBFS()
+      # Splitting the node is possible, creating the children
+      assert current_node.depth is not None
+      left_child = DecisionNode(rows=lhs_rows,
+                                index=lhs_best_split.index,
+                                value=lhs_best_split.value,
+                                depth=current_node.depth + 1)
+      right_child = DecisionNode(rows=rhs_rows,
+                                 index=rhs_best_split.index,
+                                 value=rhs_best_split.value,
+                                 depth=current_node.depth + 1)
+      if self.use_3_trees:
+        for child in (left_child, right_child):
+          child.X, child.y = X[child.rows], y[child.rows]
+          child.gradients = gradients[child.rows]
+
+      current_node.left_child = left_child
+      current_node.right_child = right_child
+      self.nodes.append(current_node)
+      # Only the children need the instances from now on
+      current_node.rows = None
+      current_node.X = current_node.y = current_node.gradients = None
+
+      # Adding them to the list of nodes for further expansion in best-gain
+      # order
+      if lhs_best_split.gain >= rhs_best_split.gain:
+        self.nodes_bfs.append(left_child)
+        self.nodes_bfs.append(right_child)
+      else:
+        self.nodes_bfs.append(right_child)
+        self.nodes_bfs.append(left_child)
 
-  def _MakeLeaf(self, node: DecisionNode) -> None:
+  def _MakeLeaf(self,
+                node: DecisionNode,
+                y: np.ndarray,
+                gradients: np.array) -> None:
     """Make a node a leaf node.
 
     Args:
       node (DecisionNode): The node to make a leaf from.
+      y (np.ndarray): The tree's dataset labels, indexed by the node's rows.
+      gradients (np.array): The gradients for the dataset instances.
     """
-    node.prediction = self.GetLeafPrediction(node.gradients, node.y)
+    node.prediction = self.GetLeafPrediction(gradients[node.rows],
+                                             y[node.rows])
     self.current_number_of_leaves += 1
     self.nodes.append(node)
 
@@ -866,51 +1116,52 @@ class DifferentiallyPrivateTree:
       bool: True if we reached the maximum number of leaf nodes,
           False otherwise.
     """
-    leaf_candidates = 0
-    for node in list(self.nodes_bfs.queue):
-      if not node.left_child and not node.right_child:
-        leaf_candidates += 1
+    # Queued nodes get their children only once popped, so they are all leaf
+    # candidates
     if self.max_leaves:
-      if self.current_number_of_leaves + leaf_candidates >= self.max_leaves:
+      if (self.current_number_of_leaves + len(self.nodes_bfs) >=
+          self.max_leaves):
         self.max_leaves_reached = True
     return self.max_leaves_reached
 
   def FindBestSplit(self,
                     X: np.array,
-                    gradients: np.array) -> Optional[Dict[str, Any]]:
+                    gradients: np.array,
+                    rows: Optional[np.array] = None) -> Optional[Split]:
     """Find best split of data using the exponential mechanism.
 
     Args:
       X (np.array): The dataset.
       gradients (np.array): The gradients for the dataset instances.
+      rows (np.array): Optional. Indices of the node's instances in X and
+          gradients. Default is all instances.
 
     Returns:
-      Optional[Dict[str, Any]]: A dictionary containing the split
-          information, or none if no split could be done.
+      Optional[Split]: The split information, or none if no split could be
+          done.
     """
-
-    # Depth + 1 because root node is at depth 0
-    privacy_budget_for_node = np.around(np.divide(self.privacy_budget/2,
-                                        self.max_depth + 1), decimals=7)
-    probabilities = []
-    max_gain = -np.inf
-    # Iterate over features
-    for feature_index in range(X.shape[1]):
-      # Iterate over unique value for this feature
-      for value in np.unique(X[:, feature_index]):
-        # Find gain for that split
-        gain = self.ComputeGain(feature_index, value, X, gradients)
-        # Compute probability for exponential mechanism
-        exp_gain = (privacy_budget_for_node * gain) / (2. * self.delta_g)
-        if exp_gain > max_gain:
-          max_gain = exp_gain
-        prob = {
-            'index': feature_index,
-            'value': value,
-            'gain': exp_gain
-        }
-        probabilities.append(prob)
-    return ExponentialMechanism(probabilities, max_gain)
+    if rows is None:
+      rows = np.arange(len(X), dtype=np.int32)
+    # Gains of all the (feature, bin) candidates from per-feature gradient
+    # histograms, in a single compiled pass if numba is available. Features
+    # are scored in parallel threads for large enough nodes.
+    if numba is None:
+      split_gains = _HistogramSplitGains
+    elif len(rows) * X.shape[1] < _MIN_PARALLEL_SPLIT_WORK:
+      split_gains = _SplitGainsSerial
+    else:
+      split_gains = _SplitGains
+    gains, counts = split_gains(X, gradients, rows, self._is_cat,
+                                self.l2_lambda, self._gains, self._counts)
+    # Candidates as parallel arrays, with their gains for the exponential
+    # mechanism
+    feature_indices, values = np.nonzero(counts)
+    exp_gains = gains[feature_indices, values] * self.exp_gain_scale
+    max_gain = exp_gains.max(initial=-np.inf)
+    choice = ExponentialMechanism(exp_gains, max_gain, rng=self._rng)
+    if choice is None:
+      return None
+    return Split(feature_indices[choice], values[choice], exp_gains[choice])
 
   def GetLeafPrediction(self, gradients: np.array, y: np.ndarray) -> float:
     """Compute the leaf prediction.
@@ -924,68 +1175,67 @@ class DifferentiallyPrivateTree:
     """
     return ComputePredictions(gradients, y, self.loss, self.l2_lambda)
 
-  def Predict(self, X: np.array) -> np.array:
+  def Predict(self, X: np.array, parallel: bool = False) -> np.array:
     """Return predictions for a list of input data.
 
     Args:
       X: The input data used for prediction.
+      parallel (bool): Optional. Whether to spread the rows over threads.
+          Only used with numba. Default is False.
 
     Returns:
       np.array: An array with the predictions.
     """
-    predictions = []
-    for row in X:
-      predictions.append(self._Predict(row, self.root_node))  # type: ignore
-    return np.asarray(predictions)
+    if numba is not None:
+      kernel = _PredictFlatParallel if parallel else _PredictFlat
+      return kernel(X, self.feature_indices, self.thresholds,
+                    self.leaf_values, self.depth)
+    return self.PredictVec(X)
 
-  def _Predict(self, row: np.array, node: DecisionNode) -> float:
-    """Walk through the decision tree to output a prediction for the row.
+  def PredictVec(self, X: np.array) -> np.array:
+    """Return predictions for a list of input data, routing all rows at once.
+
+    Uses the array layout of the tree (see `Flatten`): each iteration moves
+    every row down one level, so there are only `depth` NumPy passes. The
+    values compared are gathered with a single flat index per pass, which is
+    cheaper than indexing rows and columns of X.
 
     Args:
-      row (np.array): The row to classify.
-      node (DecisionNode): The current decision node.
+      X: The input data used for prediction.
 
     Returns:
-      float: A prediction for the row.
+      np.array: An array with the predictions.
     """
-    if node.prediction is not None:
-      return node.prediction
-    value = row[node.index]
-    if value >= node.value:
-      child_node = node.right_child
-    else:
-      child_node = node.left_child
-    return self._Predict(row, child_node)  # type: ignore
+    # Binned datasets are already column-major, so this doesn't copy them
+    values = np.asfortranarray(X).ravel(order='F')
+    n_rows = np.intp(len(X))
+    rows = np.arange(n_rows)
+    positions = np.ones(n_rows, dtype=np.intp)
+    for _ in range(self.depth):
+      go_right = (values[self.feature_indices[positions] * n_rows + rows] >=
+                  self.thresholds[positions])
+      positions = 2 * positions + go_right
+    return self.leaf_values[positions - (1 << self.depth)]
 
-  def ComputeGain(self,
-                  index: int,
-                  value: Any,
-                  X: np.array,
-                  gradients: np.array) -> float:
-    """Compute the gain for a given split.
+  def _Predict(self, row: np.array, node: DecisionNode) -> float:
+    """Walk through the decision tree to output a prediction for the row.
 
-    See https://dl.acm.org/doi/pdf/10.1145/2939672.2939785
+    Reference for the predictions from the array layout of the tree, see
+    `Predict` and `PredictVec`.
 
     Args:
-      index (int): The index for the feature to split on.
-      value (Any): The feature's value to split on.
-      X (np.array): The dataset.
-      gradients (np.array): The gradients for the dataset instances.
+      row (np.array): The row to classify.
+      node (DecisionNode): The current decision node.
 
     Returns:
-      float: The gain for the split.
+      float: A prediction for the row.
     """
-    lhs_op, rhs_op = self.GetOperators(index)
-    lhs = np.where(lhs_op(X[:, index], value))[0]
-    rhs = np.where(rhs_op(X[:, index], value))[0]
-    lhs_grad, rhs_grad = gradients[lhs], gradients[rhs]
-    lhs_gain = np.square(np.sum(lhs_grad)) / (
-        len(lhs) + self.l2_lambda)  # type: float
-    rhs_gain = np.square(np.sum(rhs_grad)) / (
-        len(rhs) + self.l2_lambda)  # type: float
-    # TODO: friedman_mse ???
-    # Total gain can be omitted since it doesn't depend on splitting value
-    return lhs_gain + rhs_gain
+    while node.prediction is None:
+      if row[node.index] >= node.value:
+        node = node.right_child  # type: ignore
+      else:
+        node = node.left_child  # type: ignore
+    return node.prediction
 
   def GetOperators(self, index: int) -> Tuple[Any, Any]:
     """Return operators to use to split a node's dataset.
@@ -996,65 +1246,190 @@ class DifferentiallyPrivateTree:
     Returns:
       Tuple[Any, Any]: The operators to use.
     """
-    if self.cat_idx and index in self.cat_idx:
+    if self._is_cat[index]:
       # Categorical feature
       return operator.eq, operator.ne
     # Numerical feature
     return operator.lt, operator.ge
 
 
-def ClipLeaves(leaves: List[DecisionNode],
-               l2_threshold: float,
-               learning_rate: float,
-               tree_index: int) -> None:
-  """Clip leaf nodes.
+class BinMapper:
+  """Map features onto a small number of integer bins.
 
-  If the prediction is higher than the threshold, set the prediction to
-  that threshold.
+  Numerical features are bucketed at quantiles of their values, categorical
+  features get one bin per category. The dataset is binned once before
+  training so that trees are grown on uint8 columns instead of float ones.
+  With fewer unique values than bins, binning doesn't change the candidate
+  splits.
 
-  Args:
-    leaves (List[DecisionNode]): The leaf nodes.
-    l2_threshold (float): Threshold of the l2 loss function.
-    learning_rate (float): The learning rate.
-    tree_index (int): The index for the current tree.
+  Attributes:
+    max_bins (int): The maximum number of bins per feature.
+    cat_idx (List): List of indices for categorical features.
+    bin_edges (List[np.array]): For each feature, the sorted values delimiting
+        its bins. For categorical features, these are the categories.
   """
-  threshold = l2_threshold * math.pow((1 - learning_rate), tree_index)
-  for leaf in leaves:
-    assert leaf.prediction is not None
-    if np.abs(leaf.prediction) > threshold:
-      if leaf.prediction > 0:
-        leaf.prediction = threshold
+  # pylint: disable=invalid-name
+
+  def __init__(self,
+               max_bins: int = 256,
+               cat_idx: Optional[List[int]] = None) -> None:
+    """Initialize the bin mapper.
+
+    Args:
+      max_bins (int): Optional. The maximum number of bins per feature, at
+          most 256 so that bins fit into uint8. Default is 256.
+      cat_idx (List): Optional. List of indices for categorical features.
+    """
+    assert 2 <= max_bins <= 256
+    self.max_bins = max_bins
+    self.cat_idx = cat_idx
+    self.bin_edges = []  # type: List[np.array]
+
+  def Fit(self, X: np.array) -> 'BinMapper':
+    """Compute the bin edges for each feature.
+
+    Args:
+      X (np.array): The dataset.
+
+    Returns:
+      BinMapper: The fitted bin mapper.
+    """
+    self.bin_edges = []
+    for feature_index in range(X.shape[1]):
+      values = np.unique(X[:, feature_index])
+      if self.cat_idx and feature_index in self.cat_idx:
+        # Last bin is kept for categories not seen during fitting
+        if len(values) > self.max_bins - 1:
+          raise ValueError(
+              'Categorical feature {0:d} has more than {1:d} '
+              'categories.'.format(feature_index, self.max_bins - 1))
+      elif len(values) > self.max_bins:
+        # Quantiles, taken amongst observed values
+        values = np.sort(X[:, feature_index])
+        positions = np.linspace(0, len(values) - 1, self.max_bins)
+        values = np.unique(values[positions.astype(np.int64)])
+      self.bin_edges.append(values)
+    return self
+
+  def Transform(self, X: np.array) -> np.array:
+    """Map a dataset onto the bins.
+
+    For numerical features, bin b holds the values in
+    [bin_edges[b], bin_edges[b + 1]), so that `bin < b` amounts to
+    `value < bin_edges[b]`.
+
+    Args:
+      X (np.array): The dataset.
+
+    Returns:
+      np.array: The bin indices as uint8, in column-major order.
+    """
+    assert len(self.bin_edges) == X.shape[1]
+    X_binned = np.empty(X.shape, dtype=np.uint8, order='F')
+    for feature_index, edges in enumerate(self.bin_edges):
+      column = X[:, feature_index]
+      if self.cat_idx and feature_index in self.cat_idx:
+        bins = np.minimum(np.searchsorted(edges, column), len(edges) - 1)
+        # Unknown categories never match a split value
+        bins[edges[bins] != column] = len(edges)
       else:
-        leaf.prediction = -1 * threshold
+        bins = np.maximum(np.searchsorted(edges, column, side='right') - 1, 0)
+      X_binned[:, feature_index] = bins
+    return X_binned
+
+  def InverseTransform(self, X_binned: np.array) -> np.array:
+    """Map binned data back onto feature values.
+
+    Each numerical bin is represented by its lower edge, i.e. the smallest
+    value it held when fitting, and each categorical bin by its category.
+    With fewer unique values than bins, this gives back the original values.
+    The bin for unknown categories is mapped to NaN.
+
+    Args:
+      X_binned (np.array): The bin indices, as returned by `Transform`.
 
+    Returns:
+      np.array: The feature values, as float64.
+    """
+    assert len(self.bin_edges) == X_binned.shape[1]
+    X = np.empty(X_binned.shape)
+    for feature_index, edges in enumerate(self.bin_edges):
+      values = np.append(edges.astype(np.float64), np.nan)
+      X[:, feature_index] = values[X_binned[:, feature_index]]
+    return X
 
-def AddLaplacianNoise(leaves: List[DecisionNode],
-                      scale: float) -> None:
-  """Add laplacian noise to the leaf nodes.
+
+def FitTree(tree: DifferentiallyPrivateTree,
+            X: np.array,
+            y: np.ndarray,
+            gradients: np.array) -> DifferentiallyPrivateTree:
+  """Fit a tree to the data, so that it can be done in a joblib worker.
 
   Args:
-    leaves (List[DecisionNode]): The list of leaves.
+    tree (DifferentiallyPrivateTree): The tree to fit.
+    X (np.array): The dataset.
+    y (np.ndarray): The dataset labels.
+    gradients (np.array): The gradients for the dataset instances.
+
+  Returns:
+    DifferentiallyPrivateTree: The fitted tree.
+  """
+  # pylint: disable=invalid-name
+  tree.Fit(X, y, gradients)
+  return tree
+
+
+def PrivatizeLeaves(leaves: List[DecisionNode],
+                    l2_threshold: float,
+                    learning_rate: float,
+                    tree_index: int,
+                    scale: float,
+                    rng: Optional[np.random.Generator] = None) -> None:
+  """Clip leaf nodes, add laplacian noise to them and shrink them.
+
+  All three steps are done in a single vectorized pass over the predictions:
+  a prediction higher than the threshold is set to that threshold, then noise
+  is added and the result is shrunk by learning_rate.
+
+  Args:
+    leaves (List[DecisionNode]): The leaf nodes.
+    l2_threshold (float): Threshold of the l2 loss function.
+    learning_rate (float): The learning rate.
+    tree_index (int): The index for the current tree.
     scale (float): The scale to use for the laplacian distribution.
+    rng (np.random.Generator): Optional. The random generator to sample
+        with. Default is a freshly seeded one.
   """
-  # Comment the line below when using the model. This is for stability for
-  # cross-validation tests only.
-  np.random.seed(0)
-  for leaf in leaves:
-    noise = np.random.laplace(0, scale)
-    leaf.prediction += noise
+  predictions = np.fromiter((leaf.prediction for leaf in leaves),
+                            dtype=np.float64,
+                            count=len(leaves))
+  threshold = l2_threshold * math.pow((1 - learning_rate), tree_index)
+  np.clip(predictions, -threshold, threshold, out=predictions)
+  rng = rng or np.random.default_rng()
+  predictions += rng.laplace(0, scale, size=len(leaves))
+  predictions *= learning_rate
+  for leaf, prediction in zip(leaves, predictions.tolist()):
+    leaf.prediction = prediction
+
 
+def GramMatrix(X: np.array) -> np.array:
+  """Compute the Gram matrix X^T X of a dataset.
 
-def Shrink(leaves: List[DecisionNode],
-           learning_rate: float) -> None:
-  """Shrink leaves by learning_rate
+  Used as a summary of a node's dataset to compare nodes when combining
+  3-trees. The distances between these summaries are scores for the
+  exponential mechanism, so they must be computed on feature values: bin
+  indices would change their scale (see `BinMapper.InverseTransform`).
 
   Args:
-    leaves (List[DecisionNode]): List of leaf nodes.
-    learning_rate (float): The learning rate by which to shrink.
+    X (np.array): The dataset.
+
+  Returns:
+    np.array: The Gram matrix, of shape (n_features, n_features).
   """
-  for leaf in leaves:
-    assert leaf.prediction is not None
-    leaf.prediction *= learning_rate
+  # pylint: disable=invalid-name
+  # Cast to float so that the products of bin indices don't overflow
+  X = X.astype(np.float64)
+  return X.T @ X
 
 
 def ComputePredictions(gradients: np.ndarray,
@@ -1097,80 +1472,210 @@ def ComputePredictions(gradients: np.ndarray,
 
 
 def ExponentialMechanism(
-    probabilities: List[Dict[str, Any]],
+    gains: np.array,
     max_gain: float,
-    reverse: bool = False) -> Optional[Dict[str, Any]]:
+    rng: Optional[np.random.Generator] = None) -> Optional[int]:
   """Apply the exponential mechanism.
 
   Args:
-    probabilities (List[Dict]): List of probabilities to choose from.
-    max_gain (float): The maximum gain amongst all probabilities in the list.
-    reverse (bool): Optional. If True, sort probabilities in reverse order (
-        i.e. lower gains are better).
+    gains (np.array): The gains of the candidates to choose from.
+    max_gain (float): The maximum gain amongst all candidates.
+    rng (np.random.Generator): Optional. The random generator to sample
+        with. Default is NumPy's global one.
 
   Returns:
-    Dict: a candidate (i.e. probability) from the list.
+    int: The index of the chosen candidate, or None if no candidate offers a
+        positive gain.
   """
-  with np.errstate(all='raise'):
-    try:
-      sum_probabilities = np.sum(
-          np.exp(prob['gain']) for prob in probabilities)
-      for prob in probabilities:
-        # e^0 is 1, so checking for that
-        if prob['gain'] == 0.:
-          prob['probability'] = 0.
-        else:
-          prob['probability'] = np.exp(prob['gain']) / sum_probabilities
-    # Happens when np.sum() overflows because of a gain that's too high
-    except FloatingPointError:
-      for prob in probabilities:
-        gain = prob['gain']
-        if gain != 0.:
-          # Check if the gain of each candidate is too small compared to
-          # the max gain seen up until now. If so, set the probability for
-          # this split to 0.
-          try:
-            _ = np.exp(max_gain - gain)
-          except FloatingPointError:
-            prob['probability'] = 0.
-          # If it's not too small, we need to compute a new sum that
-          # doesn't overflow. For that we only take into account 'large'
-          # gains with respect to the current candidate. If again the
-          # difference is so small that it would still overflow, we set the
-          # probability for this split to 0.
-          sum_prob = 0.
-          for prob_ in probabilities:
-            gain_ = prob_['gain']
-            if gain_ != 0.:
-              try:
-                sum_prob += np.exp(gain_ - gain)
-              except FloatingPointError:
-                prob['probability'] = 0.
-                break
-          # Other candidates compare similarly, so we can compute a
-          # probability. If it underflows, set it to 0 as well.
-          if sum_prob != 0.:
-            try:
-              prob['probability'] = 1.0 / sum_prob
-            except FloatingPointError:
-              prob['probability'] = 0.
-        else:
-          prob['probability'] = 0.
-
-  if (np.asarray([prob['gain'] for prob in probabilities]) <= 0.0).all():
+  if (gains <= 0.0).all():
     # No split offers a positive gain, node should be a leaf node
     return None
 
-  # Apply the exponential mechanism
-  previous_prob = 0.
-  random_prob = np.random.uniform()
-  # Sort probabilities by ascending order of gain so that higher gains
-  # split will get higher probability
-  for prob in sorted(
-      probabilities, key=lambda d: d['probability'], reverse=reverse):
-    prob['probability'] += previous_prob
-    previous_prob = prob['probability']
-    op = operator.ge if not reverse else operator.le
-    if op(prob['probability'], random_prob):
-      return prob
-  return None
+  # Only candidates within 40 of the max gain are weighted, the others would
+  # get less than e^-40 of the probability mass, below float64 precision
+  candidates = np.flatnonzero(max_gain - gains < 40.)
+  candidate_gains = gains[candidates]
+
+  # Softmax of the gains, shifted by the max gain so that it can't overflow.
+  # e^0 is 1, so candidates without gain get no probability.
+  weights = np.exp(candidate_gains - max_gain)
+  probabilities = np.where(candidate_gains == 0., 0.,
+                           weights / weights.sum())
+
+  # Apply the exponential mechanism: pick the first candidate whose
+  # cumulative probability reaches the random draw
+  random_prob = (rng or np.random).uniform()
+  choice = np.searchsorted(np.cumsum(probabilities), random_prob)
+  if choice == len(probabilities):
+    return None
+  return int(candidates[choice])
+
+
+@_Jit(parallel=True, fastmath=True, cache=True)
+def _SplitGains(X: np.array,
+                gradients: np.array,
+                rows: np.array,
+                is_cat: np.array,
+                l2_lambda: float,
+                gains: np.array,
+                counts: np.array) -> Tuple[np.array, np.array]:
+  """Compute the gain of every split candidate on binned features.
+
+  For each feature, gradients are accumulated into a per-bin histogram in a
+  single pass over the rows, then the bins are swept to score the splits:
+  `bin < b` for numerical features and `bin == b` for categorical ones.
+
+  The gain of a split is G_l^2 / (n_l + l2_lambda) + G_r^2 / (n_r + l2_lambda)
+  for the sums of gradients G and numbers of instances n on each side. See
+  https://dl.acm.org/doi/pdf/10.1145/2939672.2939785. The total gain can be
+  omitted since it doesn't depend on the split.
+
+  Args:
+    X (np.array): The binned dataset.
+    gradients (np.array): The gradients for the dataset instances.
+    rows (np.array): Indices of the node's instances in X and gradients.
+    is_cat (np.array): For each feature, whether it's categorical.
+    l2_lambda (float): Regularization parameter for l2 loss function.
+    gains (np.array): Buffer of shape (n_features, 256) for the gains, as
+        float64.
+    counts (np.array): Buffer of shape (n_features, 256) for the number of
+        instances, as int64.
+
+  Returns:
+    Tuple[np.array, np.array]: The gains and counts buffers, filled in. Bins
+        without instances are not candidates.
+  """
+  # pylint: disable=invalid-name
+  n_samples, n_features = len(rows), X.shape[1]
+  for feature_index in _prange(n_features):  # pylint: disable=not-an-iterable
+    # The gradient histogram is accumulated in the feature's gains, each bin
+    # being replaced by its gain once swept
+    hist_gradients = gains[feature_index]
+    hist_counts = counts[feature_index]
+    hist_gradients[:] = 0.
+    hist_counts[:] = 0
+    for row in rows:
+      bin_index = X[row, feature_index]
+      hist_gradients[bin_index] += gradients[row]
+      hist_counts[bin_index] += 1
+    total_gradients = hist_gradients.sum()
+    lhs_gradients, lhs_count = 0., 0
+    for bin_index in range(256):
+      bin_gradients = hist_gradients[bin_index]
+      bin_count = hist_counts[bin_index]
+      if bin_count == 0:
+        continue
+      if is_cat[feature_index]:
+        split_gradients, split_count = bin_gradients, bin_count
+      else:
+        split_gradients, split_count = lhs_gradients, lhs_count
+      rhs_gradients = total_gradients - split_gradients
+      hist_gradients[bin_index] = (
+          split_gradients ** 2 / (split_count + l2_lambda) +
+          rhs_gradients ** 2 / (n_samples - split_count + l2_lambda))
+      lhs_gradients += bin_gradients
+      lhs_count += bin_count
+  return gains, counts
+
+
+# Same kernel without threads, for nodes where starting them costs more than
+# scoring the features
+_SplitGainsSerial = _Jit(nogil=True, fastmath=True, cache=True)(_Renamed(
+    getattr(_SplitGains, 'py_func', _SplitGains), '_SplitGainsSerial'))
+
+# Below this number of (row, feature) pairs, a node's features are scored in
+# a single thread
+_MIN_PARALLEL_SPLIT_WORK = 1 << 14
+
+
+def _HistogramSplitGains(X: np.array,
+                         gradients: np.array,
+                         rows: np.array,
+                         is_cat: np.array,
+                         l2_lambda: float,
+                         gains: np.array,
+                         counts: np.array) -> Tuple[np.array, np.array]:
+  """Compute the gain of every split candidate on binned features.
+
+  NumPy version of `_SplitGains`, used when numba isn't available: the
+  histograms of all features are built with a single `np.bincount` and swept
+  with cumulative sums, so that no sorting or per-candidate pass over the
+  rows is needed.
+
+  Args:
+    X (np.array): The binned dataset.
+    gradients (np.array): The gradients for the dataset instances.
+    rows (np.array): Indices of the node's instances in X and gradients.
+    is_cat (np.array): For each feature, whether it's categorical.
+    l2_lambda (float): Regularization parameter for l2 loss function.
+    gains (np.array): Buffer of shape (n_features, 256) for the gains, as
+        float64.
+    counts (np.array): Buffer of shape (n_features, 256) for the number of
+        instances, as int64.
+
+  Returns:
+    Tuple[np.array, np.array]: The gains and counts buffers, filled in. Bins
+        without instances are not candidates.
+  """
+  # pylint: disable=invalid-name
+  n_samples, n_features = len(rows), X.shape[1]
+  # Each feature gets its own 256 bins in one flat histogram
+  bins = (X[rows].astype(np.intp) + 256 * np.arange(n_features)).ravel()
+  node_gradients = np.repeat(gradients[rows].astype(np.float64), n_features)
+  hist_gradients = np.bincount(bins,
+                               weights=node_gradients,
+                               minlength=256 * n_features).reshape(-1, 256)
+  counts[:] = np.bincount(bins, minlength=256 * n_features).reshape(-1, 256)
+  # Instances in the bins strictly before each bin for numerical features,
+  # in the bin itself for categorical ones
+  before = np.zeros((n_features, 1))
+  split_gradients = np.where(
+      is_cat[:, np.newaxis], hist_gradients,
+      np.hstack((before, np.cumsum(hist_gradients, axis=1)[:, :-1])))
+  split_counts = np.where(
+      is_cat[:, np.newaxis], counts,
+      np.hstack((before, np.cumsum(counts, axis=1)[:, :-1])))
+  rhs_gradients = hist_gradients.sum(axis=1, keepdims=True) - split_gradients
+  gains[:] = (split_gradients ** 2 / (split_counts + l2_lambda) +
+              rhs_gradients ** 2 / (n_samples - split_counts + l2_lambda))
+  return gains, counts
+
+
+@_Jit(nogil=True, cache=True)
+def _PredictFlat(X: np.array,
+                 feature_indices: np.array,
+                 thresholds: np.array,
+                 leaf_values: np.array,
+                 depth: int) -> np.array:
+  """Predict values from the array layout of a tree.
+
+  See `DifferentiallyPrivateTree.Flatten`.
+
+  Args:
+    X (np.array): The dataset for which to predict values.
+    feature_indices (np.array): For each split node, the feature's index.
+    thresholds (np.array): For each split node, the split value.
+    leaf_values (np.array): The leaf predictions, on the last level.
+    depth (int): The depth of the tree.
+
+  Returns:
+    np.array: The predictions.
+  """
+  # pylint: disable=invalid-name
+  predictions = np.empty(X.shape[0], dtype=leaf_values.dtype)
+  for row in _prange(X.shape[0]):  # pylint: disable=not-an-iterable
+    position = 1
+    for _ in range(depth):
+      position = 2 * position + int(
+          X[row, feature_indices[position]] >= thresholds[position])
+    predictions[row] = leaf_values[position - (1 << depth)]
+  return predictions
+
+
+# Same kernel with the rows spread over threads, for when predictions don't
+# already run in parallel
+_PredictFlatParallel = _Jit(parallel=True, cache=True)(_Renamed(
+    getattr(_PredictFlat, 'py_func', _PredictFlat), '_PredictFlatParallel'))
+
+# Below this number of rows, a tree's predictions are made in a single thread
+_MIN_PARALLEL_ROWS = 1 << 14
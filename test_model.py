@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""Tests for the model's split scoring, binning, predictions and privacy
+mechanism."""
+
+import unittest
+from unittest import mock
+
+import numpy as np
+# pylint: disable=import-error
+from sklearn.ensemble._gb_losses import MultinomialDeviance
+# pylint: enable=import-error
+
+import model
+
+# pylint: disable=invalid-name,protected-access
+
+
+def BruteForceSplitGains(X: np.array,
+                         gradients: np.array,
+                         rows: np.array,
+                         is_cat: np.array,
+                         l2_lambda: float) -> np.array:
+  """Compute the gain of every (feature, bin) candidate one at a time.
+
+  Args:
+    X (np.array): The binned dataset.
+    gradients (np.array): The gradients for the dataset instances.
+    rows (np.array): Indices of the node's instances in X and gradients.
+    is_cat (np.array): For each feature, whether it's categorical.
+    l2_lambda (float): Regularization parameter for l2 loss function.
+
+  Returns:
+    np.array: The gains, of shape (n_features, 256). NaN for bins without
+        instances.
+  """
+  gains = np.full((X.shape[1], 256), np.nan)
+  node_gradients = gradients[rows].astype(np.float64)
+  for feature_index in range(X.shape[1]):
+    column = X[rows, feature_index]
+    for value in np.unique(column):
+      if is_cat[feature_index]:
+        lhs = column == value
+      else:
+        lhs = column < value
+      gains[feature_index, value] = (
+          node_gradients[lhs].sum() ** 2 / (lhs.sum() + l2_lambda) +
+          node_gradients[~lhs].sum() ** 2 / ((~lhs).sum() + l2_lambda))
+  return gains
+
+
+class SplitGainsTest(unittest.TestCase):
+  """Tests for the split scoring kernels."""
+
+  def setUp(self) -> None:
+    rng = np.random.default_rng(0)
+    self.X = np.asfortranarray(np.column_stack((
+        rng.integers(0, 256, size=500),
+        rng.integers(0, 7, size=500),
+        rng.integers(0, 3, size=500),
+    )).astype(np.uint8))
+    self.gradients = rng.normal(size=500).astype(np.float32)
+    self.rows = np.sort(rng.choice(500, size=300, replace=False)).astype(
+        np.int32)
+    self.is_cat = np.array([False, True, False])
+
+  def _Gains(self, kernel: object) -> np.array:
+    gains, counts = kernel(  # type: ignore
+        self.X, self.gradients, self.rows, self.is_cat, 1.,
+        np.empty((3, 256)), np.empty((3, 256), dtype=np.int64))
+    expected_counts = np.stack([
+        np.bincount(self.X[self.rows, feature_index], minlength=256)
+        for feature_index in range(3)])
+    np.testing.assert_array_equal(counts, expected_counts)
+    # Only bins with instances are candidates
+    return np.where(counts > 0, gains, np.nan)
+
+  def testKernelsMatchBruteForce(self) -> None:
+    """All kernels score each candidate like a split of the rows would."""
+    expected = BruteForceSplitGains(self.X, self.gradients, self.rows,
+                                    self.is_cat, 1.)
+    for kernel in (model._SplitGains, model._SplitGainsSerial,
+                   model._HistogramSplitGains):
+      np.testing.assert_allclose(self._Gains(kernel), expected, rtol=1e-5)
+
+  @unittest.skipIf(model.numba is None, 'numba is not installed')
+  def testNumbaMatchesNumPy(self) -> None:
+    """The compiled kernels agree with the NumPy fallback."""
+    np.testing.assert_allclose(self._Gains(model._SplitGains),
+                               self._Gains(model._HistogramSplitGains),
+                               rtol=1e-9)
+    np.testing.assert_allclose(self._Gains(model._SplitGainsSerial),
+                               self._Gains(model._HistogramSplitGains),
+                               rtol=1e-9)
+
+
+class BinMapperTest(unittest.TestCase):
+  """Tests for the binning of the features."""
+
+  def testUnseenCategories(self) -> None:
+    """Unknown categories go to the spare bin, mapped back to NaN."""
+    X = np.array([[1., 0.5], [3., 1.5], [7., 2.5]])
+    mapper = model.BinMapper(cat_idx=[0]).Fit(X)
+    X_binned = mapper.Transform(np.array([[3., 0.5], [2., 1.5], [8., 2.5]]))
+    np.testing.assert_array_equal(X_binned[:, 0], [1, 3, 3])
+    # The spare bin never matches a split value of the feature
+    self.assertNotIn(3, mapper.Transform(X)[:, 0])
+    np.testing.assert_array_equal(X_binned[:, 1], [0, 1, 2])
+    values = mapper.InverseTransform(X_binned)
+    np.testing.assert_array_equal(values[:, 0], [3., np.nan, np.nan])
+    np.testing.assert_array_equal(values[:, 1], [0.5, 1.5, 2.5])
+
+
+class PredictTest(unittest.TestCase):
+  """Tests for the predictions from the array layout of the trees."""
+
+  def setUp(self) -> None:
+    # Leaves at depths 1, 2 and 3, so that Flatten adds dummy splits
+    self.tree = model.DifferentiallyPrivateTree(
+        0, 0.1, 1., 0.1, 1., 1., 1., MultinomialDeviance(3), max_depth=3)
+    self.tree.root_node = model.DecisionNode(
+        index=0, value=5,
+        left_child=model.DecisionNode(prediction=0.5),
+        right_child=model.DecisionNode(
+            index=1, value=3,
+            left_child=model.DecisionNode(
+                index=0, value=200,
+                left_child=model.DecisionNode(prediction=-1.25),
+                right_child=model.DecisionNode(prediction=2.)),
+            right_child=model.DecisionNode(prediction=0.75)))
+    self.tree.Flatten()
+    self.X = np.random.default_rng(0).integers(
+        0, 256, size=(1000, 2)).astype(np.uint8)
+
+  def testPredictMatchesNodeWalk(self) -> None:
+    """All prediction paths agree with walking through the nodes."""
+    expected = [self.tree._Predict(row, self.tree.root_node)  # type: ignore
+                for row in self.X]
+    self.assertEqual(self.tree.depth, 3)
+    self.assertEqual(set(expected), {0.5, -1.25, 2., 0.75})
+    for X in (self.X, np.asfortranarray(self.X)):
+      np.testing.assert_array_equal(self.tree.Predict(X), expected)
+      np.testing.assert_array_equal(self.tree.Predict(X, parallel=True),
+                                    expected)
+      np.testing.assert_array_equal(self.tree.PredictVec(X), expected)
+
+  def testParallelOnlyWithJobs(self) -> None:
+    """Trees spread rows over threads only when n_jobs asks for it."""
+    X = np.tile(self.X, (model._MIN_PARALLEL_ROWS // len(self.X) + 1, 1))
+    for n_jobs, parallel in ((None, False), (1, False), (2, True)):
+      ensemble = model.GradientBoostingEnsemble(1, 1, n_classes=3,
+                                                n_jobs=n_jobs)
+      ensemble.bin_mapper = model.BinMapper().Fit(np.arange(256.)[:, None] *
+                                                  np.ones((1, 2)))
+      ensemble.init_score = np.zeros(3, dtype=np.float32)
+      ensemble.trees = [[self.tree] * 3]
+      with mock.patch.object(self.tree, 'Predict',
+                             wraps=self.tree.Predict) as predict:
+        ensemble.Predict(X.astype(np.float64))
+      self.assertEqual(
+          {call.kwargs.get('parallel', False)
+           for call in predict.call_args_list},
+          {parallel and model.numba is not None})
+
+
+class ExponentialMechanismTest(unittest.TestCase):
+  """Tests for the exponential mechanism."""
+
+  def testNoPositiveGain(self) -> None:
+    """No candidate is chosen when none offers a positive gain."""
+    self.assertIsNone(model.ExponentialMechanism(
+        np.array([0., -1., -3.]), 0., rng=np.random.default_rng(0)))
+
+  def testTruncatedCandidatesAreNeverChosen(self) -> None:
+    """Only candidates within the cutoff of the max gain are chosen."""
+    gains = np.array([100., 0., 99.5, 50., 59.9, 30.])
+    rng = np.random.default_rng(0)
+    choices = {
+        model.ExponentialMechanism(gains, gains.max(), rng=rng)
+        for _ in range(2000)
+    }
+    self.assertEqual(choices, {0, 2})
+
+
+class SeedTest(unittest.TestCase):
+  """Tests for the reproducibility of seeded models."""
+
+  def testSeededRunsMatchAcrossJobs(self) -> None:
+    """A seeded model doesn't depend on the number of jobs."""
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(600, 3))
+    y = np.argmax(X, axis=1)
+    predictions = []
+    for n_jobs in (None, 2):
+      ensemble = model.GradientBoostingEnsemble(
+          6, 6, n_classes=3, max_depth=3, privacy_budget=1.,
+          learning_rate=0.1, n_jobs=n_jobs, seed=42)
+      ensemble.Train(X, y)
+      predictions.append(ensemble.Predict(X))
+    np.testing.assert_array_equal(predictions[0], predictions[1])
+
+
+if __name__ == '__main__':
+  unittest.main()